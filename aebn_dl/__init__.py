@@ -1,3 +1,10 @@
-from .downloader import Downloader
-
 __all__ = ["Downloader"]
+
+
+def __getattr__(name):
+    # import lazily, lxml and curl_cffi are only loaded when a download is set up
+    if name == "Downloader":
+        from .downloader import Downloader
+
+        return Downloader
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
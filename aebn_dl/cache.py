@@ -0,0 +1,95 @@
+import json
+import os
+import tempfile
+import threading
+import time
+from typing import Optional
+
+CACHE_DIR = os.path.join(tempfile.gettempdir(), "aebn_cache")
+DEFAULT_MAX_AGE = 3600  # seconds
+# set to any non-empty value to bypass the cache, useful for debugging
+DISABLE_ENV_VAR = "AEBN_DL_NO_CACHE"
+# the page and manifest of a movie are saved from different threads, guards the index read-modify-write
+_index_lock = threading.Lock()
+
+
+def _enabled() -> bool:
+    return not os.environ.get(DISABLE_ENV_VAR)
+
+
+def _cache_path(movie_id: str) -> str:
+    return os.path.join(CACHE_DIR, f"{movie_id}.json")
+
+
+def _content_path(movie_id: str, key: str) -> str:
+    return os.path.join(CACHE_DIR, f"{movie_id}_{key}.bin")
+
+
+def _read_entries(movie_id: str) -> dict:
+    try:
+        with open(_cache_path(movie_id), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_atomic(path: str, data: bytes) -> None:
+    fd, temp_path = tempfile.mkstemp(dir=CACHE_DIR, suffix=".tmp")
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+    os.replace(temp_path, path)
+
+
+def load(movie_id: str, key: str) -> Optional[dict]:
+    """Return a cached entry for the movie regardless of its age, None if missing"""
+    if not _enabled():
+        return None
+    entry = _read_entries(movie_id).get(key)
+    if not entry:
+        return None
+    if entry.get("has_content"):
+        try:
+            with open(_content_path(movie_id, key), "rb") as f:
+                entry["content"] = f.read()
+        except OSError:
+            return None
+    return entry
+
+
+def is_fresh(entry: Optional[dict], max_age: int = DEFAULT_MAX_AGE) -> bool:
+    """Check if an entry can be used without asking the server"""
+    return bool(entry) and time.time() - entry["fetched_at"] <= max_age
+
+
+def save(movie_id: str, key: str, entry: dict, content: Optional[bytes] = None) -> None:
+    """Store an entry for the movie, raw content is kept as is in a file next to it"""
+    if not _enabled():
+        return
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    if content is not None:
+        _write_atomic(_content_path(movie_id, key), content)
+    with _index_lock:
+        entries = _read_entries(movie_id)
+        entries[key] = {**entry, "has_content": content is not None, "fetched_at": time.time()}
+        _write_atomic(_cache_path(movie_id), json.dumps(entries).encode("utf-8"))
+
+
+def revalidating_get(session, movie_id: str, key: str, url: str, cached: Optional[dict] = None, entry: Optional[dict] = None) -> bytes:
+    """GET url with conditional headers from a stale cached entry, reuse its content on 304 and store the result"""
+    headers = {}
+    if cached and cached.get("etag"):
+        headers["If-None-Match"] = cached["etag"]
+    if cached and cached.get("last_modified"):
+        headers["If-Modified-Since"] = cached["last_modified"]
+
+    response = session.get(url, headers=headers)
+    if response.status_code == 304 and cached:
+        content = cached["content"]
+        validators = {"etag": cached.get("etag"), "last_modified": cached.get("last_modified")}
+    elif response.ok:
+        content = response.content
+        validators = {"etag": response.headers.get("etag"), "last_modified": response.headers.get("last-modified")}
+    else:
+        return response.content
+    save(movie_id, key, {**(entry or {}), **validators}, content=content)
+    return content
@@ -1,15 +1,21 @@
 import argparse
 import concurrent.futures
+import copy
 import logging
+import mmap
+import os
 import signal
 import sys
 from urllib.parse import urlparse
 from typing import Literal
 
-from . import Downloader
+from .log_utils import CachedTimeFormatter
 
 
 def download_movie(args):
+    # deferred, so the CLI starts without loading the download stack
+    from .downloader import Downloader
+
     Downloader(
         url=args.url,
         output_dir=args.output_dir,
@@ -29,6 +35,8 @@ def download_movie(args):
         keep_logs=args.keep_logs,
         proxy=args.proxy,
         proxy_metadata_only=args.proxy_metadata,
+        use_http2=not args.http1,
+        connections=args.connections,
     ).run()
 
 
@@ -36,7 +44,10 @@ def new_logger(log_level: Literal["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL
     """Set un and return a logger with given log level"""
     main_logger = logging.getLogger("main_logger")
     main_logger.setLevel(log_level)
-    formatter = logging.Formatter("%(asctime)s|%(levelname)s|%(message)s", datefmt="%H:%M:%S")
+    if main_logger.handlers:
+        return main_logger  # already set up, don't stack duplicate handlers
+    main_logger.propagate = False
+    formatter = CachedTimeFormatter("%(asctime)s|%(levelname)s|%(message)s", datefmt="%H:%M:%S")
     main_handler = logging.StreamHandler()
     main_handler.setFormatter(formatter)
     main_logger.addHandler(main_handler)
@@ -48,14 +59,18 @@ def convert_line_endings(file_path):
     windows_line_ending = b"\r\n"
     unix_line_ending = b"\n"
 
-    with open(file_path, "rb") as open_file:
-        content = open_file.read()
+    if os.path.getsize(file_path) == 0:
+        return  # nothing to convert, and empty files can't be mapped
+
+    # scan the mapped file first, the common already-unix case needs no copy or write
+    with open(file_path, "rb") as open_file, mmap.mmap(open_file.fileno(), 0, access=mmap.ACCESS_READ) as content:
+        if content.find(windows_line_ending) == -1:
+            return
+        converted = content[:].replace(windows_line_ending, unix_line_ending)
 
     # Windows to Unix
-    if windows_line_ending in content:
-        content = content.replace(windows_line_ending, unix_line_ending)
-        with open(file_path, "wb") as open_file:
-            open_file.write(content)
+    with open(file_path, "wb") as open_file:
+        open_file.write(converted)
 
 
 def log_error(future):
@@ -71,9 +86,8 @@ def process_list_txt(logger: logging.Logger, args: argparse.Namespace) -> None:
         convert_line_endings("list.txt")  # important to have the proper newlines for linux
         logger.debug("Converted list.txt to unix line endings, important for linux processing")
     with open("list.txt", encoding="utf-8") as f:
-        urllist = f.read().splitlines()  # remove the newlines
-    while "" in urllist:  # remove empty strings from the list (resulted from empty lines)
-        urllist.remove("")
+        # skip empty lines and comments in a single pass
+        urllist = [line.strip() for line in f.read().splitlines() if line.strip() and not line.startswith("#")]
 
     logger.info("""
 \033[0;31m\033[1mWARNING: An excessive concurrent download of scenes/movies
@@ -89,9 +103,7 @@ Be reasonable and use with caution!\033[0m""")
     with concurrent.futures.ThreadPoolExecutor(max_workers=max_threads) as executor:
         futures = []
         for line in urllist:
-            if line.startswith("#"):
-                continue
-            task_args = argparse.Namespace(**vars(args))  # Create a copy of args
+            task_args = copy.copy(args)  # shallow copy, only url and scene are replaced
             if "|" in line:
                 task_args.url = line.split("|")[0]
                 task_args.scene = int(line.split("|")[1])
@@ -102,10 +114,7 @@ Be reasonable and use with caution!\033[0m""")
             futures.append(future)
 
 
-def main():
-    # Make Ctrl-C work when deamon threads are running
-    signal.signal(signal.SIGINT, signal.SIG_DFL)
-
+def _build_parser() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser()
     parser.add_argument("url", help="URL of the movie or list.txt")
     parser.add_argument("-o", "--output_dir", type=str, help="Specify the output directory")
@@ -118,6 +127,8 @@ def main():
     parser.add_argument("-es", "--end-segment", type=int, help="Specify the end segment")
     parser.add_argument("-p", "--proxy", type=str, help="Proxy to use (format: protocol://username:password@ip:port)")
     parser.add_argument("-pm", "--proxy-metadata", action="store_true", help="Use proxies for metadata only, and not for downloading")
+    parser.add_argument("--http1", action="store_true", help="Disable HTTP/2 and use HTTP/1.1 connections, for servers or proxies with broken HTTP/2 support")
+    parser.add_argument("-cn", "--connections", type=int, help="Segments to download in parallel for each movie (default=8)")
     parser.add_argument("-c", "--covers", action="store_true", help="Download front and back covers")
     parser.add_argument("-ow", "--overwrite", action="store_true", help="Overwrite existing audio and video segments, if already present")
     parser.add_argument("-ts", "--target-stream", choices=["audio", "video"], help="Download just video or just audio stream")
@@ -134,7 +145,17 @@ def main():
     )
     parser.add_argument("-t", "--threads", type=int, help="Threads for concurrent downloads with list.txt (default=5)")
     parser.add_argument("-l", "--log-level", choices=["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"], default="INFO", help="Set the logging level (default: INFO) Any level above INFO would also disable progress bars")
-    args = parser.parse_args()
+    return parser
+
+
+_PARSER = _build_parser()
+
+
+def main():
+    # Make Ctrl-C work when deamon threads are running
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+
+    args = _PARSER.parse_args()
 
     # validate the url
     result = urlparse(args.url)
@@ -1,36 +1,99 @@
 import random
+import threading
 from time import sleep
 from functools import partialmethod
 from typing import Optional
 
+from curl_cffi import CurlHttpVersion, CurlOpt
 from curl_cffi import requests as cc_requests
 
 from .exceptions import NetworkError
 
+# rate limiting and server errors that are usually gone on the next attempt,
+# any other error status is returned right away as retrying would not change it
+RETRY_STATUS_CODES = frozenset({429, 500, 502, 503, 504})
+
 
 class CustomSession(cc_requests.Session):
     """Custom curl_cffi session with retries"""
 
-    def __init__(self, max_retries: Optional[int] = 3, initial_retry_delay: Optional[int] = 1, backoff_factor: Optional[int] = 2, *args, **kwargs):
-        super().__init__(*args, **kwargs)
+    def __init__(
+        self,
+        max_retries: Optional[int] = 3,
+        initial_retry_delay: Optional[int] = 1,
+        backoff_factor: Optional[int] = 2,
+        max_backoff: Optional[int] = 30,
+        max_connections: Optional[int] = 10,
+        use_http2: Optional[bool] = True,
+        retry_on: Optional[frozenset[int]] = RETRY_STATUS_CODES,
+        *args,
+        **kwargs,
+    ):
+        if use_http2:
+            kwargs.setdefault("http_version", CurlHttpVersion.V2TLS)
+        # curl_cffi gives every thread its own curl handle and runs stream=True requests on a copy of it,
+        # connections are not shared between threads or streamed requests, these options tune each transfer
+        curl_options = kwargs.pop("curl_options", None) or {}
+        curl_options.setdefault(CurlOpt.MAXCONNECTS, max_connections)
+        # larger receive buffer means fewer reads per multi-MB segment
+        curl_options.setdefault(CurlOpt.BUFFERSIZE, 256 * 1024)
+        curl_options.setdefault(CurlOpt.TCP_NODELAY, 1)
+        curl_options.setdefault(CurlOpt.TCP_KEEPALIVE, 1)
+        super().__init__(*args, curl_options=curl_options, **kwargs)
+        self.headers.setdefault("Connection", "keep-alive")
         self.max_retries = max_retries
         self.initial_retry_delay = initial_retry_delay
         self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        self.retry_on = retry_on
+        # curl handles are thread-local, remember them so close() can release every thread's handle
+        self._curl_handles = set()
+        self._curl_handles_lock = threading.Lock()
+
+    @property
+    def curl(self):
+        curl = super().curl
+        with self._curl_handles_lock:
+            self._curl_handles.add(curl)
+        return curl
+
+    def close(self) -> None:
+        """Close the curl handles of all threads that used the session"""
+        super().close()
+        with self._curl_handles_lock:
+            handles, self._curl_handles = self._curl_handles, set()
+        for curl in handles:
+            curl.close()
+        if self._executor is not None:
+            # only created by stream=True requests, which the downloader does not make
+            self._executor.shutdown(wait=False)
+
+    def backoff(self, previous_delay: Optional[float] = None) -> float:
+        """Sleep before a retry, return the delay to pass in for the next one"""
+        # Decorrelated jitter, each delay is drawn relative to the previous one
+        # so concurrent retries spread out instead of hitting the server in waves
+        previous_delay = previous_delay or self.initial_retry_delay
+        backoff_delay = min(self.max_backoff, random.uniform(self.initial_retry_delay, previous_delay * self.backoff_factor))
+        sleep(backoff_delay)
+        return backoff_delay
 
     def custom_request(self, method: str, url: str, *args, **kwargs) -> cc_requests.Response:
-        """request wrapper with retries"""
+        """request wrapper with retries on network errors and transient server errors"""
         attempt = 0
-        while attempt < self.max_retries:
+        backoff_delay = None
+        while True:
+            attempt += 1
             try:
-                return super().request(method, url, *args, **kwargs)
+                response = super().request(method, url, *args, **kwargs)
             except cc_requests.RequestsError as e:
-                attempt += 1
                 if attempt >= self.max_retries:
                     raise NetworkError from e
-                # Calculate the backoff delay
-                backoff_delay = self.initial_retry_delay * (self.backoff_factor ** (attempt - 1))
-                backoff_delay += random.uniform(0, 1)  # Adding randomness for jitter
-                sleep(backoff_delay)  # Wait before retrying
+            else:
+                if response.status_code not in self.retry_on or attempt >= self.max_retries:
+                    return response
+                if kwargs.get("stream"):
+                    response.close()  # release the unread body before retrying
+            backoff_delay = self.backoff(backoff_delay)  # Wait before retrying
 
     # replace `request` with `custom_request`
     head = partialmethod(custom_request, "HEAD")
@@ -1,8 +1,12 @@
-import datetime
+import collections
+import concurrent.futures
 import email.utils as eut
+import itertools
 import logging
 
 import os
+import tempfile
+import threading
 import time
 from typing import Literal, Optional
 
@@ -15,6 +19,13 @@ from .movie_scraper import Movie
 from .manifest_parser import Manifest
 from .exceptions import Forbidden
 
+# default concurrent segment requests per movie, each worker thread uses its own connection
+SEGMENT_DOWNLOAD_WORKERS = 8
+
+# shared part files being written by downloaders in this process
+_claimed_part_files = set()
+_claimed_part_files_lock = threading.Lock()
+
 
 class Downloader:
     def __init__(
@@ -37,6 +48,10 @@ class Downloader:
         include_performer_names: Optional[bool] = False,
         log_level: Optional[Literal["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"]] = "INFO",
         keep_logs: Optional[bool] = False,
+        use_http2: Optional[bool] = True,
+        connections: Optional[int] = SEGMENT_DOWNLOAD_WORKERS,
+        initial_manifest_url: Optional[str] = None,
+        initial_manifest_content: Optional[bytes] = None,
     ):
         """
         Args:
@@ -58,6 +73,10 @@ class Downloader:
             force_resolution: If True, force the specified resolution even if it's not available. Defaults to False.
             include_performer_names: If True, include performer names in the output file name. Defaults to False.
             keep_logs: If True, keep log files after processing. Defaults to False.
+            use_http2: If True, negotiate HTTP/2 with the server. Defaults to True.
+            connections: The number of segments downloaded in parallel. Defaults to 8.
+            initial_manifest_url: An already requested manifest url, skips asking the server for a new one.
+            initial_manifest_content: The content of initial_manifest_url, skips downloading it.
         """
 
         self.input_url = url
@@ -78,34 +97,53 @@ class Downloader:
         self.keep_logs = keep_logs
         self.proxy = proxy
         self.proxy_metadata_only = proxy_metadata_only
+        self.use_http2 = use_http2
+        self.connections = connections or SEGMENT_DOWNLOAD_WORKERS
+        self.initial_manifest_url = initial_manifest_url
+        self.initial_manifest_content = initial_manifest_content
         self.logger = utils.new_logger(name=self._movie_logger_name(), log_level=log_level)
         self.is_silent = self.logger.getEffectiveLevel() > logging.INFO
         self.movie_work_dir: str = None
+        self._work_dir_prefix: str = None
         self.manifest: Manifest = None
         self.session: CustomSession = None
+        self._manifest_lock = threading.Lock()
+        # bumped on every manifest refresh, lets workers tell if someone else already refreshed
+        self._manifest_generation = 0
+        self._existing_files: set[str] = set()
+        # set when one stream fails, so the other one stops submitting segments
+        self._stop_downloads = threading.Event()
 
     def run(self) -> None:
         """Executes the movie download process."""
         self._initialize_download()
-        scraped_movie = self._scrape_movie_info()
-        self._process_manifest(scraped_movie)
-        output_file_name = self._generate_output_name(scraped_movie)
-        self._create_dirs(scraped_movie.movie_id)
-        self._set_stream_paths()
-        if self.download_covers:
-            self._download_movie_covers(scraped_movie)
-        output_path = os.path.join(self.output_dir, output_file_name)
-        self.logger.info(f"Output file name: {output_file_name}")
-        self._download_streams(scraped_movie)
+        try:
+            self._init_manifest()
+            with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+                # the manifest request doesn't depend on the movie page, fetch it while scraping
+                manifest_future = executor.submit(self.manifest.fetch_manifest)
+                scraped_movie = self._scrape_movie_info()
+                fetched_manifest = manifest_future.result()
+            self._process_manifest(scraped_movie, fetched_manifest)
+            output_file_name = self._generate_output_name(scraped_movie)
+            self._create_dirs(scraped_movie.movie_id)
+            self._set_stream_paths()
+            if self.download_covers:
+                self._download_movie_covers(scraped_movie)
+            output_path = os.path.join(self.output_dir, output_file_name)
+            self.logger.info(f"Output file name: {output_file_name}")
+            self._download_streams(scraped_movie)
+        finally:
+            # release pooled connections, the session is not needed past downloading
+            self.session.close()
         self._process_streams(output_path)
         self._cleanup()
 
     def _init_new_session(self, use_proxies=True) -> None:
         """Init new curl_cffi session"""
-        self.session = CustomSession(impersonate="chrome")
-        self.session.timeout = 30
+        self.session = CustomSession(impersonate="chrome", use_http2=self.use_http2)
+        self.session.timeout = (5, 30)  # connect, read
         self.session.headers["User-Agent"] = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/130.0.0.0 Safari/537.36"
-        self.session.headers["Connection"] = "keep-alive"
         self.session.cookies.update({"ageGated": "", "terms": ""})
         if self.proxy and use_proxies:
             self.session.proxies = {"http": self.proxy, "https": self.proxy}
@@ -175,8 +213,7 @@ class Downloader:
 
     def _concat_stream(self, stream: MediaStream) -> None:
         """Concat stream segments into a single file"""
-        if os.path.exists(stream.path):
-            os.remove(stream.path)
+        # an existing stream file is truncated by concat_segments, no need to remove it first
         utils.concat_segments(
             files=stream.downloaded_segments,
             output_path=stream.path,
@@ -208,9 +245,8 @@ class Downloader:
         """Renames the target stream to the output path."""
         for stream in (self.manifest.audio_stream, self.manifest.video_stream):
             if stream.human_name == self.target_stream:
-                if os.path.exists(output_path):
-                    os.remove(output_path)
-                os.rename(stream.path, output_path)
+                # overwrites an existing output in a single atomic step
+                os.replace(stream.path, output_path)
 
     def _download_movie_covers(self, scraped_movie: Movie) -> None:
         """Downloads the movie covers."""
@@ -227,18 +263,26 @@ class Downloader:
         os.makedirs(self.output_dir, exist_ok=True)
         self.movie_work_dir = os.path.join(self.work_dir, movie_id)
         os.makedirs(self.movie_work_dir, exist_ok=True)
+        # segment paths are built per segment, skip os.path.join on the hot path
+        self._work_dir_prefix = self.movie_work_dir + os.sep
 
-    def _process_manifest(self, scraped_movie: Movie) -> None:
-        """Processes the movie manifest."""
-        self.logger.info("Processing manifest")
+    def _init_manifest(self) -> None:
+        """Creates the manifest, the movie duration is filled in once scraped."""
         self.manifest = Manifest(
             self.input_url,
-            scraped_movie.total_duration_seconds,
+            None,
             self.session,
             target_height=self.target_height,
             force_resolution=self.force_resolution,
+            initial_manifest_url=self.initial_manifest_url,
+            initial_manifest_content=self.initial_manifest_content,
         )
-        self.manifest.process_manifest()
+
+    def _process_manifest(self, scraped_movie: Movie, fetched_manifest: tuple[str, bytes, bool]) -> None:
+        """Processes the movie manifest."""
+        self.logger.info("Processing manifest")
+        self.manifest.total_duration_seconds = scraped_movie.total_duration_seconds
+        self.manifest.process_manifest(fetched=fetched_manifest)
         scraped_movie.calculate_scenes_boundaries(self.manifest.segment_duration)
 
     def _scrape_movie_info(self) -> Movie:
@@ -267,23 +311,23 @@ class Downloader:
         response = self.session.get(cover_url)
         with open(output, "wb") as f:
             f.write(response.content)
-        last_modified = response.headers["last-modified"]
-        modified = time.mktime(datetime.datetime(*eut.parsedate(last_modified)[:6]).timetuple())  # type: ignore
-        now = time.mktime(datetime.datetime.today().timetuple())
-        os.utime(output, (now, modified))
+        last_modified = response.headers.get("last-modified")
+        if last_modified:
+            # honours the zone in the header, a missing one is taken as UTC instead of local time
+            modified = eut.mktime_tz(eut.parsedate_tz(last_modified))
+            os.utime(output, (time.time(), modified))
 
         if os.path.isfile(output):
             self.logger.info(f"Saved cover: {output}")
 
     def _work_folder_cleanup(self) -> None:
         if not self.keep_segments_after_download:
+            temp_files = []
             for stream in (self.manifest.audio_stream, self.manifest.video_stream):
                 if stream.human_name != self.target_stream:
-                    if os.path.exists(stream.path):
-                        os.remove(stream.path)
-                for segment_path in stream.downloaded_segments:
-                    if os.path.exists(segment_path):
-                        os.remove(segment_path)
+                    temp_files.append(stream.path)
+                temp_files.extend(stream.downloaded_segments)
+            utils.remove_files(self.movie_work_dir, temp_files)
             self.logger.info("Deleted temp files")
 
         if not os.listdir(self.movie_work_dir):
@@ -302,66 +346,184 @@ class Downloader:
             except IndexError as e:
                 raise IndexError(f"Scene {self.scene_n} not found!") from e
         else:
+            if not self.end_segment:
+                self._trim_missing_last_segment()
             start_segment = self.start_segment or 0
             end_segment = self.end_segment or self.manifest.total_number_of_data_segments
             segment_range = (start_segment, end_segment)
 
         self.logger.info(f"Downloading segments {segment_range[0]} - {segment_range[1]}")
 
+        # one directory scan instead of a stat call per segment
+        self._existing_files = set(os.listdir(self.movie_work_dir))
+
+        streams = [
+            stream for stream in (self.manifest.audio_stream, self.manifest.video_stream) if not self.target_stream or stream.human_name == self.target_stream
+        ]
+        self._stop_downloads.clear()
+        # streams are downloaded side by side, sharing one segment worker pool
+        with (
+            concurrent.futures.ThreadPoolExecutor(max_workers=self.connections) as executor,
+            concurrent.futures.ThreadPoolExecutor(max_workers=len(streams)) as stream_executor,
+        ):
+            stream_futures = [
+                stream_executor.submit(self._download_stream, stream, segment_range, executor, position) for position, stream in enumerate(streams)
+            ]
+            try:
+                for stream_future in stream_futures:
+                    stream_future.result()
+            except BaseException:
+                # let the other stream stop early instead of finishing its download
+                self._stop_downloads.set()
+                raise
+
+    def _trim_missing_last_segment(self, refreshed: bool = False) -> None:
+        """Drop the calculated last segment up front if the server doesn't have it"""
+        # segment calc returns a rounded up float which is sometimes bigger than the actual number of segments
+        last_segment = self.manifest.total_number_of_data_segments
         for stream in (self.manifest.audio_stream, self.manifest.video_stream):
-            if stream.human_name == self.target_stream:
-                self._download_stream(stream, segment_range)
-            elif not self.target_stream:
-                self._download_stream(stream, segment_range)
-
-    def _download_stream(self, stream: MediaStream, segment_range: tuple[int, int]) -> None:
+            if self.target_stream and stream.human_name != self.target_stream:
+                continue
+            segment_url = f"{self.manifest.base_stream_url}/{stream.media_type}_{stream.stream_id}_{last_segment}.mp4d"
+            status_code = self.session.head(segment_url).status_code
+            if status_code == 403 and not refreshed:
+                # the manifest url has expired, check again with a fresh one
+                self._refresh_manifest(self._manifest_generation)
+                return self._trim_missing_last_segment(refreshed=True)
+            if status_code != 404:
+                return
+        self.logger.debug("Last segment is 404, skipping")
+        self.manifest.total_number_of_data_segments -= 1
+
+    def _download_stream(self, stream: MediaStream, segment_range: tuple[int, int], executor: concurrent.futures.Executor, position: int = 0) -> None:
         """Download stream segments in given range"""
         self.logger.debug(f"Downloading {stream.human_name} stream ID: {stream.stream_id}")
         # downloading init segment
-        self._download_segment(stream, overwrite=self.overwrite_existing_files)
+        stream.downloaded_segments.append(self._download_segment_or_refresh(stream))
 
         # using tqdm object to manipulate progress
         # and display it as init segment was part of the loop
 
         segments_to_download = range(segment_range[0], segment_range[1] + 1)
-        download_bar = tqdm(total=len(segments_to_download) + 1, desc=stream.human_name.capitalize() + " download", disable=self.is_silent)
+        download_bar = tqdm(total=len(segments_to_download) + 1, desc=stream.human_name.capitalize() + " download", position=position, mininterval=0.5, disable=self.is_silent)
         download_bar.update()  # increment by 1
-        for i in segments_to_download:
-            try:
-                self._download_segment(stream, segment_number=i, overwrite=self.overwrite_existing_files)
-            except Forbidden:
-                self.manifest.process_manifest()
+        segment_numbers = iter(segments_to_download)
+        # keep a fixed window of segments in flight and take results in order,
+        # the next segment is submitted only when the oldest one is done
+        max_inflight = self.connections * 2
+        pending = collections.deque(executor.submit(self._download_segment_or_refresh, stream, i) for i in itertools.islice(segment_numbers, max_inflight))
+        try:
+            while pending and not self._stop_downloads.is_set():
+                segment_path = pending.popleft().result()
+                segment_number = next(segment_numbers, None)
+                if segment_number is not None:
+                    pending.append(executor.submit(self._download_segment_or_refresh, stream, segment_number))
+                if segment_path:
+                    stream.downloaded_segments.append(segment_path)
+                download_bar.update()
+        except BaseException:
+            self._stop_downloads.set()
+            raise
+        finally:
+            for future in pending:
+                future.cancel()
+            download_bar.close()
+
+    def _download_segment_or_refresh(self, stream: MediaStream, segment_number: Optional[int] = None) -> str | None:
+        """Download segment, refreshing the manifest once if access is forbidden"""
+        generation = self._manifest_generation
+        try:
+            return self._download_segment(stream, segment_number=segment_number, overwrite=self.overwrite_existing_files)
+        except Forbidden:
+            self._refresh_manifest(generation)
+            return self._download_segment(stream, segment_number=segment_number, overwrite=self.overwrite_existing_files)
+
+    def _refresh_manifest(self, generation: int) -> None:
+        """Fetch a new manifest url, unless it was refreshed since the given generation"""
+        with self._manifest_lock:
+            # only the first worker to hit the expired url refreshes, the rest reuse its result
+            if self._manifest_generation == generation:
+                self.manifest.process_manifest(refresh=True)
+                self._manifest_generation += 1
                 self.logger.debug("Manifest refreshed")
-                self._download_segment(stream, segment_number=i, overwrite=self.overwrite_existing_files)
-            download_bar.update()
-        download_bar.close()
 
-    def _download_segment(self, stream: MediaStream, segment_number: Optional[int] = None, overwrite: Optional[bool] = False) -> None:
-        """Download and save stream segment"""
+    def _fetch_segment(self, segment_url: str, part_file):
+        """Download a segment into its part file, continuing a partial one, return the response"""
+        # media is already compressed, and ranges must count raw bytes for resuming
+        headers = {"Accept-Encoding": "identity"}
+        offset = part_file.seek(0, os.SEEK_END)
+        if offset:
+            headers["Range"] = f"bytes={offset}-"
+
+        # not streamed, stream=True runs on a fresh copy of the thread's curl handle and opens a new connection
+        response = self.session.get(segment_url, headers=headers)
+        if response.status_code == 416 and offset:
+            # partial file is unusable, download from scratch
+            part_file.truncate(0)
+            return self._fetch_segment(segment_url, part_file)
+        if response.ok:
+            if response.status_code != 206:
+                # a full response starts the file over, 206 continues it
+                part_file.seek(0)
+                part_file.truncate()
+            part_file.write(response.content)
+        return response
+
+    def _download_segment(self, stream: MediaStream, segment_number: Optional[int] = None, overwrite: Optional[bool] = False) -> str | None:
+        """Download and save stream segment, return its path"""
         if segment_number:
             segment_name = f"{stream.media_type}_{stream.stream_id}_{segment_number}"
         else:
             segment_name = f"{stream.media_type}i_{stream.stream_id}"
 
         segment_url = f"{self.manifest.base_stream_url}/{segment_name}.mp4d"
-        segment_path = os.path.join(self.movie_work_dir, f"{segment_name}.mp4")
-        if os.path.exists(segment_path) and not overwrite:
+        segment_file_name = f"{segment_name}.mp4"
+        segment_path = f"{self._work_dir_prefix}{segment_file_name}"
+        if segment_file_name in self._existing_files and not overwrite:
             self.logger.debug(f"{segment_name} found on disk")
-            stream.downloaded_segments.append(segment_path)
-            return
+            return segment_path
+
+        shared_part_path = f"{segment_path}.part"
+        with _claimed_part_files_lock:
+            claimed = shared_part_path not in _claimed_part_files
+            if claimed:
+                _claimed_part_files.add(shared_part_path)
+        try:
+            # resume a part file left by an interrupted run, unless another downloader is writing it right now,
+            # list.txt scenes of one movie share the init segment and their boundary segments
+            part_file = utils.open_locked(shared_part_path) if claimed else None
+            if part_file is None:
+                fd, part_path = tempfile.mkstemp(dir=self.movie_work_dir, prefix=f"{segment_file_name}.", suffix=".tmp")
+                part_file = open(fd, "r+b", buffering=0)
+            else:
+                part_path = shared_part_path
+                if overwrite:
+                    part_file.truncate(0)
 
-        response = self.session.get(segment_url)
+            response = None
+            try:
+                response = self._fetch_segment(segment_url, part_file)
+            finally:
+                if response is not None and response.ok:
+                    utils.release_locked(part_file, part_path, segment_path)
+                elif part_path != shared_part_path or not os.fstat(part_file.fileno()).st_size:
+                    utils.release_locked(part_file, part_path)  # nothing worth resuming later
+                else:
+                    part_file.close()
+        finally:
+            if claimed:
+                with _claimed_part_files_lock:
+                    _claimed_part_files.discard(shared_part_path)
 
         if response.ok:
-            with open(segment_path, "wb") as f:
-                f.write(response.content)
-            stream.downloaded_segments.append(segment_path)
+            self._existing_files.add(segment_file_name)
             self.logger.debug(f"{segment_name} saved to disk")
-        elif response.status_code == 404 and segment_number == self.manifest.total_number_of_data_segments:
+            return segment_path
+        if response.status_code == 404 and segment_number == self.manifest.total_number_of_data_segments:
             # just skip if the last segment does not exist
             # segment calc returns a rounded up float which is sometimes bigger than the actual number of segments
             self.logger.debug("Last segment is 404, skipping")
-        elif response.status_code == 403:
+            return None
+        if response.status_code == 403:
             raise Forbidden
-        else:
-            raise RuntimeError(f"{segment_name} Download error! Response Status : {response.status_code}")
+        raise RuntimeError(f"{segment_name} Download error! Response Status : {response.status_code}")
@@ -0,0 +1,20 @@
+import logging
+
+
+class CachedTimeFormatter(logging.Formatter):
+    """Formatter reusing the formatted time for records logged within the same second"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._cached_time = (None, "")
+
+    def formatTime(self, record, datefmt=None):
+        if not datefmt:
+            # the default format includes milliseconds
+            return super().formatTime(record, datefmt)
+        second = int(record.created)
+        cached_second, formatted = self._cached_time
+        if cached_second != second:
+            formatted = super().formatTime(record, datefmt)
+            self._cached_time = (second, formatted)
+        return formatted
@@ -1,15 +1,37 @@
+import collections
+import concurrent.futures
+import itertools
 import math
+from io import BytesIO
 from typing import Optional
 import lxml.etree as ET
 
-from . import utils
+from . import cache, utils
 from .models import AudioStream, VideoStream
 from .custom_session import CustomSession
+from .exceptions import Forbidden
+
+AUDIO_PROBE_MAX_AGE = 24 * 3600  # seconds
+AUDIO_PROBE_WORKERS = 2
 
 
 class Manifest:
-    def __init__(self, url: str, total_duration_seconds: int, session: CustomSession, target_height: Optional[int] = 1, force_resolution: Optional[bool] = False):
+    def __init__(
+        self,
+        url: str,
+        total_duration_seconds: Optional[int],
+        session: CustomSession,
+        target_height: Optional[int] = 1,
+        force_resolution: Optional[bool] = False,
+        initial_manifest_url: Optional[str] = None,
+        initial_manifest_content: Optional[bytes] = None,
+    ):
         self.input_url = url
+        self.initial_manifest_url = initial_manifest_url
+        self.initial_manifest_content = initial_manifest_content
+        url_parts = url.split("/")
+        self.url_content_type = url_parts[3]
+        self.movie_id = url_parts[5]
         self.total_duration_seconds = total_duration_seconds
         self.session = session
         self.target_height = target_height
@@ -21,81 +43,153 @@ class Manifest:
         self.audio_stream = AudioStream()
         self.avaliable_resulutions: list[int] = None
 
-    def parse_content(self, manifest_content: str) -> None:
+    def parse_content(self, manifest_content: bytes) -> None:
         """Parse the XML manifest content"""
-        root = ET.fromstring(manifest_content, None)
-        self.total_number_of_data_segments = self._total_number_of_data_segments_calc(root, self.total_duration_seconds)
-        video_streams = self._parse_and_sort_video_streams(root)
+        video_streams = self._parse_and_sort_video_streams(manifest_content)
+        self.total_number_of_data_segments = self._total_number_of_data_segments_calc(self.total_duration_seconds)
         self.avaliable_resulutions = [video_stream[1] for video_stream in video_streams]
         audio_stream_id = self._find_best_good_audio_stream(video_streams)
         self.audio_stream.stream_id = audio_stream_id
-        if self.target_height == 0:
-            # lowest resolution
-            stream_id, height = video_streams[0]
-            self.video_stream.stream_id = stream_id
-            self.video_stream.height = height
-            return
+        self.video_stream.stream_id, self.video_stream.height = self._select_video_stream(video_streams)
+
+    def _select_video_stream(self, video_streams: list[tuple[str, int]]) -> tuple[str, int]:
+        """Pick the video stream for the target height from streams sorted by height"""
         if self.target_height is None:
             # highest resolution
-            stream_id, height = video_streams[-1]
-            self.video_stream.stream_id = stream_id
-            self.video_stream.height = height
-            return
-        if self.target_height:
-            # other resolution
-            video_stream_id = next((sublist[0] for sublist in video_streams if sublist[1] == self.target_height), None)
-            if not video_stream_id and self.force_resolution:
-                raise RuntimeError(f"Target video resolution height {self.target_height} not found")
-            video_stream_id, height = next((sublist for sublist in reversed(video_streams) if sublist[1] <= self.target_height), None)
-            self.video_stream.stream_id = stream_id
-            self.video_stream.height = height
+            return video_streams[-1]
+        if self.target_height == 0:
+            # lowest resolution
+            return video_streams[0]
+        # other resolution, single pass from the top for an exact or the nearest lower match
+        for stream_id, height in reversed(video_streams):
+            if height <= self.target_height:
+                if height != self.target_height and self.force_resolution:
+                    break
+                return stream_id, height
+        if self.force_resolution:
+            raise RuntimeError(f"Target video resolution height {self.target_height} not found")
+        # nothing at or below the target, the lowest resolution is the nearest
+        return video_streams[0]
 
-    def _total_number_of_data_segments_calc(self, root, total_duration_seconds):
+    def _total_number_of_data_segments_calc(self, total_duration_seconds: int) -> int:
         """Calculate total number of segments"""
-        # Get timescale
-        timescale = float(root.xpath('.//*[local-name()="AdaptationSet" and @mimeType="video/mp4"]//*[local-name()="SegmentTemplate"]/@timescale')[0])
-        duration = float(root.xpath('.//*[local-name()="AdaptationSet" and @mimeType="video/mp4"]//*[local-name()="SegmentTemplate"]/@duration')[0])
-        # segment duration calc
-        self.segment_duration = duration / timescale
-        # number of segments calc
         total_number_of_data_segments = total_duration_seconds / self.segment_duration
         total_number_of_data_segments = math.ceil(total_number_of_data_segments)
         return total_number_of_data_segments
 
     def _find_best_good_audio_stream(self, video_streams: list[tuple[str, int]]) -> str:
         """Find a valid HQ audio stream with ffmpeg, as they can be corrupted"""
-        for stream_id, _ in reversed(video_streams):
-            init_segment_name = f"ai_{stream_id}"
-            init_segment_url = f"{self.base_stream_url}/{init_segment_name}.mp4d"
-            init_segment_bytes = self.session.get(init_segment_url).content
-            # grab audio segment from the middle of the stream
-            data_segment_number = int(self.total_number_of_data_segments / 2)
-            data_segment_name = f"a_{stream_id}_{data_segment_number}"
-            data_segment_url = f"{self.base_stream_url}/{data_segment_name}.mp4d"
-            data_segment_bytes = self.session.get(data_segment_url).content
-            if utils.is_valid_media(init_segment_bytes + data_segment_bytes):
-                return stream_id
-            # skip if not valid
+        stream_ids = [stream_id for stream_id, _ in reversed(video_streams)]
+        # the probe result doesn't change for a movie, skip it when resuming or refreshing the manifest
+        cached = cache.load(self.movie_id, "audio_stream")
+        if cache.is_fresh(cached, AUDIO_PROBE_MAX_AGE) and cached["stream_id"] in stream_ids:
+            return cached["stream_id"]
+        # validate candidates best first, fetching the next one while the current one is checked
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=AUDIO_PROBE_WORKERS)
+        probes = collections.deque()
+        try:
+            remaining = iter(stream_ids)
+            for stream_id in itertools.islice(remaining, AUDIO_PROBE_WORKERS):
+                probes.append((stream_id, executor.submit(self._get_audio_probe, stream_id)))
+            while probes:
+                stream_id, probe = probes.popleft()
+                if utils.is_valid_media(probe.result()):
+                    cache.save(self.movie_id, "audio_stream", {"stream_id": stream_id})
+                    return stream_id
+                # skip if not valid
+                next_stream_id = next(remaining, None)
+                if next_stream_id is not None:
+                    probes.append((next_stream_id, executor.submit(self._get_audio_probe, next_stream_id)))
+        finally:
+            for _, probe in probes:
+                probe.cancel()
+            # a probe already running holds a curl handle, let it finish before the session can be closed
+            executor.shutdown(wait=True, cancel_futures=True)
         raise RuntimeError("No valid audio stream found")
 
-    def _parse_and_sort_video_streams(self, root) -> list[tuple[str, int]]:
-        video_adaptation_sets = root.xpath('.//*[local-name()="AdaptationSet" and @mimeType="video/mp4"]//*[local-name()="Representation"]')
-        video_streams = [(element.get("id"), int(element.get("height"))) for element in video_adaptation_sets]
+    def _get_audio_probe(self, stream_id: str) -> bytes:
+        """Get the audio init segment joined with a data segment from the middle of the stream"""
+        init_segment_name = f"ai_{stream_id}"
+        init_segment_url = f"{self.base_stream_url}/{init_segment_name}.mp4d"
+        init_segment_response = self.session.get(init_segment_url)
+        if init_segment_response.status_code == 403:
+            raise Forbidden
+        init_segment_bytes = init_segment_response.content
+        # grab audio segment from the middle of the stream
+        data_segment_number = int(self.total_number_of_data_segments / 2)
+        data_segment_name = f"a_{stream_id}_{data_segment_number}"
+        data_segment_url = f"{self.base_stream_url}/{data_segment_name}.mp4d"
+        data_segment_bytes = self.session.get(data_segment_url).content
+        return init_segment_bytes + data_segment_bytes
+
+    def _parse_and_sort_video_streams(self, manifest_content: bytes) -> list[tuple[str, int]]:
+        """Stream through the manifest, collecting video representations and the video segment duration"""
+        video_streams = []
+        self.segment_duration = None
+        elements = ET.iterparse(
+            BytesIO(manifest_content),
+            events=("end",),
+            tag=("{*}SegmentTemplate", "{*}Representation"),
+            collect_ids=False,  # no id lookups, skip the id hash table
+            remove_blank_text=True,
+            remove_comments=True,
+        )
+        for _, element in elements:
+            if self._in_video_adaptation_set(element):
+                if ET.QName(element).localname == "Representation":
+                    video_streams.append((element.get("id"), int(element.get("height") or 0)))
+                elif self.segment_duration is None:
+                    # segment duration calc
+                    self.segment_duration = float(element.get("duration")) / float(element.get("timescale"))
+            element.clear()
+            # drop already processed siblings so the partial tree stays small
+            while element.getprevious() is not None:
+                del element.getparent()[0]
         sorted_video_streams = sorted(video_streams, key=lambda video_stream: video_stream[1])
         return sorted_video_streams
 
+    @staticmethod
+    def _in_video_adaptation_set(element) -> bool:
+        adaptation_set = next(element.iterancestors("{*}AdaptationSet"), None)
+        return adaptation_set is not None and adaptation_set.get("mimeType") == "video/mp4"
+
     def _get_new_manifest_url(self) -> str:
-        url_content_type = self.input_url.split("/")[3]
-        movie_id = self.input_url.split("/")[5]
         headers = {}
         headers["content-type"] = "application/x-www-form-urlencoded"
-        data = f"movieId={movie_id}&isPreview=true&format=DASH"
-        url = f"https://{url_content_type}.aebn.com/{url_content_type}/deliver"
+        data = f"movieId={self.movie_id}&isPreview=true&format=DASH"
+        url = f"https://{self.url_content_type}.aebn.com/{self.url_content_type}/deliver"
         content = self.session.post(url, headers=headers, data=data).json()
         return content["url"]
 
-    def process_manifest(self):
+    def fetch_manifest(self, refresh: bool = False) -> tuple[str, bytes, bool]:
+        """Get the manifest url and content, reusing a given or recently cached one unless refresh is set"""
+        if not refresh and self.initial_manifest_url:
+            # the caller's manifest may be stale too, a forbidden probe falls back to a refresh
+            manifest_content = self.initial_manifest_content or self.session.get(self.initial_manifest_url).content
+            return self.initial_manifest_url, manifest_content, True
+        cached = cache.load(self.movie_id, "manifest")
+        if not refresh and cache.is_fresh(cached):
+            return cached["url"], cached["content"], True
         manifest_url = self._get_new_manifest_url()
+        # signed urls change on every request, but the manifest itself rarely does
+        manifest_content = cache.revalidating_get(self.session, self.movie_id, "manifest", manifest_url, cached, {"url": manifest_url})
+        return manifest_url, manifest_content, False
+
+    def process_manifest(self, refresh: bool = False, fetched: Optional[tuple[str, bytes, bool]] = None) -> None:
+        """Parse the manifest, fetching it first unless an already fetched one is given"""
+        manifest_url, manifest_content, from_cache = fetched or self.fetch_manifest(refresh)
         self.base_stream_url = manifest_url.rsplit("/", 1)[0]
-        manifest_content = self.session.get(manifest_url).content
-        self.parse_content(manifest_content)
+        try:
+            self.parse_content(manifest_content)
+            if from_cache and not self._stream_url_allowed():
+                raise Forbidden
+        except Forbidden:
+            if not from_cache:
+                raise
+            # the cached manifest url has expired
+            self.process_manifest(refresh=True)
+
+    def _stream_url_allowed(self) -> bool:
+        """Check a reused manifest url still grants access, a cached audio probe no longer tells"""
+        init_segment_url = f"{self.base_stream_url}/{self.video_stream.media_type}i_{self.video_stream.stream_id}.mp4d"
+        return self.session.head(init_segment_url).status_code != 403
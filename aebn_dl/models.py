@@ -1,7 +1,7 @@
 from dataclasses import dataclass, field
 
 
-@dataclass
+@dataclass(slots=True)
 class Scene:
     performers: list
     start_timing: int = field(init=False)
@@ -10,7 +10,7 @@ class Scene:
     end_segment: int = field(init=False)
 
 
-@dataclass
+@dataclass(slots=True)
 class MediaStream:
     human_name: str
     media_type: str
@@ -19,13 +19,13 @@ class MediaStream:
     downloaded_segments: list[str] = field(default_factory=list)
 
 
-@dataclass
+@dataclass(slots=True)
 class AudioStream(MediaStream):
     human_name: str = "audio"
     media_type: str = "a"
 
 
-@dataclass
+@dataclass(slots=True)
 class VideoStream(MediaStream):
     human_name: str = "video"
     media_type: str = "v"
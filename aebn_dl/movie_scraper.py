@@ -1,10 +1,33 @@
 import math
-from lxml import html
+import threading
+from lxml import etree, html
 
-from . import utils
+from . import cache, utils
 from .models import Scene
 from .custom_session import CustomSession
 
+# compiled once, instead of parsing the expressions on every scrape
+_XP_TITLE = etree.XPath('//*[@class="dts-section-page-heading-title"]/h1/text()')
+_XP_DURATION = etree.XPath('//*[@class="section-detail-list-item-duration"][2]/text()')
+_XP_STUDIO_NAMES = etree.XPath('//*[@class="dts-studio-name-wrapper"]/a/text()')
+_XP_PERFORMERS = etree.XPath('//section[@id="dtsPanelStarsDetailMovie"]//a/@title')
+_XP_SCENE_PERFORMERS = etree.XPath('//li[@class="dts-scene-strip-stars"]')
+_XP_LINK_TEXT = etree.XPath(".//a/text()")
+_XP_COVER_FRONT = etree.XPath('//*[@class="dts-movie-boxcover-front"]//img/@src')
+_XP_COVER_BACK = etree.XPath('//*[@class="dts-movie-boxcover-back"]//img/@src')
+_XP_SCENE_TIMINGS = etree.XPath('//div[@class="scroller"]')
+
+# lxml parsers can't be used from several threads at once, keep one per thread for list.txt downloads
+_parsers = threading.local()
+
+
+def _html_parser() -> html.HTMLParser:
+    """Return this thread's reusable HTML parser"""
+    parser = getattr(_parsers, "parser", None)
+    if parser is None:
+        parser = _parsers.parser = html.HTMLParser(remove_comments=True)
+    return parser
+
 
 class Movie:
     def __init__(self, url: str, session: CustomSession):
@@ -24,27 +47,35 @@ class Movie:
 
     def _scrape_info(self):
         """Scrape movie metadata from aebn.com"""
-        content = html.fromstring(self.session.get(self.input_url).content)
-        self.url_content_type = self.input_url.split("/")[3]
-        self.movie_id = self.input_url.split("/")[5]
+        url_parts = self.input_url.split("/")
+        self.url_content_type = url_parts[3]
+        self.movie_id = url_parts[5]
+        content = html.fromstring(self._get_page_content(), parser=_html_parser())
         self.studio_name = self._extract_studio_name(content)
-        self.title = content.xpath('//*[@class="dts-section-page-heading-title"]/h1/text()')[0].strip()
-        total_duration_string = content.xpath('//*[@class="section-detail-list-item-duration"][2]/text()')[0].strip()
+        self.title = _XP_TITLE(content)[0].strip()
+        total_duration_string = _XP_DURATION(content)[0].strip()
         self.total_duration_seconds = utils.duration_to_seconds(total_duration_string)
         self.studio_name = utils.remove_chars(self.studio_name)
         self.title = utils.remove_chars(self.title)
-        self.performers = content.xpath('//section[@id="dtsPanelStarsDetailMovie"]//a/@title')
-        scene_performers_elements = content.xpath('//li[@class="dts-scene-strip-stars"]')
+        self.performers = _XP_PERFORMERS(content)
+        scene_performers_elements = _XP_SCENE_PERFORMERS(content)
         for preformers_element in scene_performers_elements:
-            scene = Scene(performers=preformers_element.xpath(".//a/text()"))
+            scene = Scene(performers=_XP_LINK_TEXT(preformers_element))
             self.scenes.append(scene)
-        cover_front = content.xpath('//*[@class="dts-movie-boxcover-front"]//img/@src')[0].strip()
+        cover_front = _XP_COVER_FRONT(content)[0].strip()
         self.cover_url_front = "https:" + cover_front.split("?")[0]
-        cover_back = content.xpath('//*[@class="dts-movie-boxcover-back"]//img/@src')[0].strip()
+        cover_back = _XP_COVER_BACK(content)[0].strip()
         self.cover_url_back = "https:" + cover_back.split("?")[0]
 
+    def _get_page_content(self) -> bytes:
+        """Get the movie page, from cache if recently fetched"""
+        cached = cache.load(self.movie_id, "page")
+        if cache.is_fresh(cached):
+            return cached["content"]
+        return cache.revalidating_get(self.session, self.movie_id, "page", self.input_url, cached)
+
     def _extract_studio_name(self, content) -> str:
-        studio_names = content.xpath('//*[@class="dts-studio-name-wrapper"]/a/text()')
+        studio_names = _XP_STUDIO_NAMES(content)
         if len(studio_names) > 0:
             return studio_names[0].replace(",", "").strip()
         return ""
@@ -52,11 +83,11 @@ class Movie:
     def calculate_scenes_boundaries(self, segment_duration: float):
         """Calculate scene segment boundaries with data from m.aebn.net"""
         response = self.session.get(f"https://m.aebn.net/movie/{self.movie_id}")
-        html_tree = html.fromstring(response.content)
-        scene_elems = html_tree.xpath('//div[@class="scroller"]')
+        html_tree = html.fromstring(response.content, parser=_html_parser())
+        scene_elems = _XP_SCENE_TIMINGS(html_tree)
         for i, scene_el in enumerate(scene_elems):
             target_scene = self.scenes[i]
             target_scene.start_timing = int(scene_el.get("data-time-start"))
             target_scene.end_timing = target_scene.start_timing + int(scene_el.get("data-time-duration"))
-            target_scene.start_segment = math.floor(int(target_scene.start_timing) / segment_duration)
-            target_scene.end_segment = math.ceil(int(target_scene.end_timing) / segment_duration)
+            target_scene.start_segment = math.floor(target_scene.start_timing / segment_duration)
+            target_scene.end_segment = math.ceil(target_scene.end_timing / segment_duration)
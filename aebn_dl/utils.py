@@ -1,28 +1,47 @@
+import concurrent.futures
+import errno
+import functools
 import logging
 import subprocess
 from typing import Optional
 import shutil
 import os
 import sys
+import threading
 
 from tqdm import tqdm
 
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # windows, files are only coordinated within the process there
+
 from .exceptions import FFmpegError
+from .log_utils import CachedTimeFormatter
+
+# characters not allowed in file names
+_STRIP_TABLE = str.maketrans("", "", '#?!:<>"/\\|*')
 
 
 def remove_chars(text: str) -> str:
     """Remove characters from string"""
-    for ch in ["#", "?", "!", ":", "<", ">", '"', "/", "\\", "|", "*"]:
-        if ch in text:
-            text = text.replace(ch, "")
-    return text
+    return text.translate(_STRIP_TABLE)
 
 
 def new_logger(name: str, log_level: str) -> logging.Logger:
     logger = logging.getLogger(name)
     logger.setLevel(logging.DEBUG)  # Set the logger level to the lowest (DEBUG)
+    logger.propagate = False
+
+    if logger.handlers:
+        # same movie downloaded again in this process, reuse the handlers instead of stacking duplicates
+        for handler in logger.handlers:
+            if handler.name == "console_handler":
+                handler.setLevel(log_level)
+        return logger
 
-    formatter = logging.Formatter("%(asctime)s|%(levelname)s|%(message)s", datefmt="%H:%M:%S")
+    # per segment debug records share the time string instead of running strftime for each
+    formatter = CachedTimeFormatter("%(asctime)s|%(levelname)s|%(message)s", datefmt="%H:%M:%S")
 
     # Console handler with user set level
     console_handler = logging.StreamHandler()
@@ -49,27 +68,23 @@ def new_logger(name: str, log_level: str) -> logging.Logger:
 
 def duration_to_seconds(duration: str) -> int:
     """Convert HH:MM:SS to seconds"""
-    time_parts = list(map(int, duration.split(":")))
-    time_parts.reverse()  # Reverse the list to start from seconds
-    total_seconds = 0
-    for i, part in enumerate(time_parts):
-        if i == 0:  # Seconds
-            total_seconds += part
-        elif i == 1:  # Minutes
-            total_seconds += part * 60
-        elif i == 2:  # Hours
-            total_seconds += part * 3600
-    return total_seconds
-
-
-def ffmpeg_mux_streams(stream_path_1: str, stream_path_2: str, output_path: str, ffmpeg_dir: Optional[str] = None, silent: bool = False) -> None:
-    """Mux two media streams with ffmpeg"""
-    cmd = f'ffmpeg -i "{stream_path_1}" -i "{stream_path_2}" -y -c copy "{output_path}"'
+    seconds = 0
+    for part in duration.split(":"):
+        seconds = seconds * 60 + int(part)
+    return seconds
+
+
+def ffmpeg_mux_streams(
+    stream_path_1: str, stream_path_2: str, output_path: str, ffmpeg_dir: Optional[str] = None, silent: bool = False, threads: int = 0
+) -> None:
+    """Mux two media streams with ffmpeg, threads=0 lets ffmpeg pick the thread count"""
+    cmd = [_ffmpeg_path() or "ffmpeg", "-i", stream_path_1, "-i", stream_path_2, "-y", "-c", "copy", "-threads", str(threads), output_path]
 
     if silent:
-        cmd += " -loglevel warning"
+        cmd[1:1] = ["-loglevel", "warning"]
 
-    out = subprocess.run(cmd, shell=True, cwd=ffmpeg_dir, capture_output=True, text=True, check=False)
+    # argv list, no shell in between and no quoting issues with paths
+    out = subprocess.run(cmd, cwd=ffmpeg_dir, capture_output=True, text=True, check=False)
 
     if not out.returncode == 0:
         raise FFmpegError(out.stderr)
@@ -77,36 +92,177 @@ def ffmpeg_mux_streams(stream_path_1: str, stream_path_2: str, output_path: str,
 
 def concat_segments(files, output_path, tqdm_desc, aggressive_cleaning: bool, silent=False):
     """Concat segments into a single file"""
-    concat_progress = tqdm(files, desc=f"Joining {tqdm_desc}", disable=silent)
-    with open(output_path, "wb") as f:
-        for segment_file_path in files:
-            with open(segment_file_path, "rb") as segment_file:
-                content = segment_file.read()
-                segment_file.close()
-                f.write(content)
+    # miniters skips the refresh time check on most updates when there are thousands of segments
+    concat_progress = tqdm(files, desc=f"Joining {tqdm_desc}", mininterval=0.5, miniters=max(1, len(files) // 200), disable=silent)
+    removals = []
+    # joined segments are deleted on a background thread, so unlinking doesn't hold up copying
+    with open(output_path, "wb", buffering=0) as f, concurrent.futures.ThreadPoolExecutor(max_workers=1) as deleter:
+        if not aggressive_cleaning:
+            # segments deleted while joining free their space as the output grows, reserving it all up front would need twice as much
+            preallocate(f, sum(os.path.getsize(segment_file_path) for segment_file_path in files))
+        try:
+            for segment_file_path in files:
+                with open(segment_file_path, "rb", buffering=0) as segment_file:
+                    append_file(segment_file, f)
                 concat_progress.update()
-            if aggressive_cleaning:
-                os.remove(segment_file_path)
+                if aggressive_cleaning:
+                    removals.append(deleter.submit(os.remove, segment_file_path))
+        finally:
+            f.truncate()  # drop preallocated space that was not written
     concat_progress.close()
+    for removal in removals:
+        removal.result()  # surface removal errors
+
+
+def append_file(source, destination) -> None:
+    """Append source file content to destination, copying in kernel space on linux"""
+    if sys.platform == "linux":
+        size = os.fstat(source.fileno()).st_size
+        offset = 0
+        try:
+            while offset < size:
+                sent = os.sendfile(destination.fileno(), source.fileno(), offset, size - offset)
+                if not sent:
+                    break
+                offset += sent
+            return
+        except OSError:
+            # sendfile is not supported for these files, copy the rest in user space
+            source.seek(offset)
+    shutil.copyfileobj(source, destination)
+
+
+def remove_files(directory: str, paths) -> None:
+    """Remove files located in directory, skipping the ones that are already gone"""
+    if os.unlink not in os.supports_dir_fd:
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        return
+    # resolve the directory once instead of walking the full path for every file
+    dir_fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        for path in paths:
+            try:
+                os.unlink(os.path.basename(path), dir_fd=dir_fd)
+            except FileNotFoundError:
+                pass
+    finally:
+        os.close(dir_fd)
+
+
+def open_locked(path: str):
+    """Open a file for reading and writing without truncating it, None if another process holds its lock"""
+    file = open(os.open(path, os.O_RDWR | os.O_CREAT | getattr(os, "O_BINARY", 0), 0o666), "r+b", buffering=0)
+    if fcntl is None:
+        return file
+    try:
+        fcntl.flock(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        # the previous holder may have moved the file into place before letting go of it
+        if os.fstat(file.fileno()).st_ino == os.stat(path).st_ino:
+            return file
+    except OSError:
+        pass
+    file.close()
+    return None
+
+
+def release_locked(file, path: str, destination: Optional[str] = None) -> None:
+    """Move a file from open_locked to destination, or delete it without one, then close it"""
+    if fcntl is None:
+        file.close()  # windows can't rename or delete open files
+    try:
+        # where possible the lock is held until the file is gone from path
+        if destination:
+            os.replace(path, destination)
+        else:
+            os.remove(path)
+    finally:
+        file.close()
+
+
+def preallocate(file, size: int) -> None:
+    """Reserve contiguous disk space for a file before writing, where supported"""
+    if size <= 0 or not hasattr(os, "posix_fallocate"):
+        return
+    try:
+        os.posix_fallocate(file.fileno(), 0, size)
+    except OSError as e:
+        if e.errno == errno.ENOSPC:
+            raise
+        # filesystem does not support it, the write will allocate as usual
+
+
+def _mp4_boxes_complete(media_bytes: bytes) -> bool:
+    """Check if media bytes are a sequence of complete top level mp4 boxes"""
+    offset = 0
+    end = len(media_bytes)
+    while offset < end:
+        if end - offset < 8:
+            return False
+        box_size = int.from_bytes(media_bytes[offset : offset + 4], "big")
+        if box_size == 1:
+            # 64-bit size stored after the box type
+            if end - offset < 16:
+                return False
+            box_size = int.from_bytes(media_bytes[offset + 8 : offset + 16], "big")
+        elif box_size == 0:
+            return True  # box extends to the end of the data
+        if box_size < 8:
+            return False
+        offset += box_size
+    return end > 0 and offset == end
 
 
 def is_valid_media(media_bytes: bytes) -> bool:
     """Check if media bytes are are read as valid media with fmmpeg"""
-    cmd = "ffmpeg -f mp4 -i pipe:0 -f null -"
+    if not _mp4_boxes_complete(media_bytes):
+        return False  # truncated or malformed, no need to start ffmpeg
+    # -nostdin only stops ffmpeg reading interactive commands, pipe:0 is still the input
+    cmd = [_ffmpeg_path() or "ffmpeg", "-nostdin", "-hide_banner", "-f", "mp4", "-i", "pipe:0", "-f", "null", "-"]
+
+    # Use subprocess.Popen with PIPE to create a pipe for input, no shell in between
+    process = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, bufsize=1 << 20)
+    found_error = threading.Event()
+
+    def watch_stderr():
+        # stop ffmpeg on the first error instead of scanning stderr after all input is consumed
+        for line in iter(process.stderr.readline, b""):
+            if b"Multiple frames in a packet" in line or b"Error" in line:
+                found_error.set()
+                process.kill()
+                break
+        process.stderr.close()
 
-    # Use subprocess.Popen with PIPE to create a pipe for input
-    process = subprocess.Popen(cmd, shell=True, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+    watcher = threading.Thread(target=watch_stderr, daemon=True)
+    watcher.start()
 
-    # Write the media bytes to the stdin of the FFmpeg process
-    _, stderr_data = process.communicate(input=media_bytes)
+    # Write the media bytes to the stdin of the FFmpeg process in chunks, stop pushing once an error shows up
+    view = memoryview(media_bytes)
+    try:
+        for offset in range(0, len(view), 1 << 20):
+            if found_error.is_set():
+                break
+            process.stdin.write(view[offset : offset + (1 << 20)])
+        process.stdin.close()
+    except OSError:
+        pass  # broken pipe, ffmpeg exited or was killed
+    process.wait()
+    watcher.join()
 
     # Check if FFmpeg found any errors
-    if b"Multiple frames in a packet" in stderr_data or b"Error" in stderr_data:
-        return False  # Not Valid
-    return True  # Valid
+    return not found_error.is_set()
+
+
+@functools.lru_cache(maxsize=1)
+def _ffmpeg_path() -> Optional[str]:
+    """Resolve ffmpeg in PATH once, so later runs exec it directly"""
+    return shutil.which("ffmpeg")
 
 
 def ffmpeg_check() -> None:
     """Ensure ffmpeg is available in PATH"""
-    if not shutil.which("ffmpeg"):
+    if not _ffmpeg_path():
         raise FileNotFoundError("ffmpeg not found! Please add it to PATH or provide its directory as an argument.")
@@ -0,0 +1,95 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+from typing import Optional
+from unittest import mock
+
+from aebn_dl import cache
+
+
+class FakeResponse:
+    def __init__(self, status_code: int, content: bytes = b"", headers: Optional[dict] = None):
+        self.status_code = status_code
+        self.ok = 200 <= status_code < 400
+        self.content = content
+        self.headers = headers or {}
+
+
+class FakeSession:
+    def __init__(self, response: FakeResponse):
+        self.response = response
+        self.request_headers = None
+
+    def get(self, url, headers=None):
+        self.request_headers = headers
+        return self.response
+
+
+class CacheTest(unittest.TestCase):
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        patcher = mock.patch.object(cache, "CACHE_DIR", temp_dir.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        env_patcher = mock.patch.dict(os.environ, {cache.DISABLE_ENV_VAR: ""})
+        env_patcher.start()
+        self.addCleanup(env_patcher.stop)
+
+    def test_save_and_load(self):
+        cache.save("1", "manifest", {"url": "http://a"}, content=b"<MPD/>")
+        entry = cache.load("1", "manifest")
+        self.assertEqual(entry["url"], "http://a")
+        self.assertEqual(entry["content"], b"<MPD/>")
+        self.assertTrue(cache.is_fresh(entry))
+
+    def test_load_missing(self):
+        self.assertIsNone(cache.load("1", "page"))
+        self.assertFalse(cache.is_fresh(None))
+
+    def test_stale_entry(self):
+        cache.save("1", "page", {})
+        entry = cache.load("1", "page")
+        entry["fetched_at"] = time.time() - cache.DEFAULT_MAX_AGE - 1
+        self.assertFalse(cache.is_fresh(entry))
+
+    def test_disabled(self):
+        with mock.patch.dict(os.environ, {cache.DISABLE_ENV_VAR: "1"}):
+            cache.save("1", "page", {})
+            self.assertIsNone(cache.load("1", "page"))
+
+    def test_concurrent_saves_keep_every_key(self):
+        threads = [threading.Thread(target=cache.save, args=("1", f"key{i}", {"i": i})) for i in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for i in range(20):
+            self.assertEqual(cache.load("1", f"key{i}")["i"], i)
+
+    def test_revalidating_get_not_modified(self):
+        cache.save("1", "page", {"etag": '"v1"'}, content=b"old")
+        cached = cache.load("1", "page")
+        session = FakeSession(FakeResponse(304))
+        content = cache.revalidating_get(session, "1", "page", "http://a", cached)
+        self.assertEqual(content, b"old")
+        self.assertEqual(session.request_headers, {"If-None-Match": '"v1"'})
+        self.assertEqual(cache.load("1", "page")["etag"], '"v1"')
+
+    def test_revalidating_get_new_content(self):
+        session = FakeSession(FakeResponse(200, b"new", {"etag": '"v2"'}))
+        content = cache.revalidating_get(session, "1", "page", "http://a", None, {"url": "http://a"})
+        self.assertEqual(content, b"new")
+        entry = cache.load("1", "page")
+        self.assertEqual((entry["content"], entry["etag"], entry["url"]), (b"new", '"v2"', "http://a"))
+
+    def test_revalidating_get_error_is_not_cached(self):
+        session = FakeSession(FakeResponse(500, b"error"))
+        self.assertEqual(cache.revalidating_get(session, "1", "page", "http://a"), b"error")
+        self.assertIsNone(cache.load("1", "page"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,142 @@
+import logging
+import os
+import tempfile
+import types
+import unittest
+
+from aebn_dl import downloader
+from aebn_dl.downloader import Downloader
+from aebn_dl.exceptions import Forbidden, NetworkError
+from aebn_dl.models import VideoStream
+
+SEGMENT = b"0123456789abcdef"
+
+
+class FakeResponse:
+    def __init__(self, status_code: int, content: bytes = b""):
+        self.status_code = status_code
+        self.ok = 200 <= status_code < 400
+        self.content = content
+
+
+class FakeSession:
+    """Serves SEGMENT, honouring ranges, with scripted outcomes per request"""
+
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.ranges = []
+
+    def get(self, url, headers=None):
+        byte_range = headers.get("Range")
+        self.ranges.append(byte_range)
+        offset = int(byte_range[len("bytes=") : -1]) if byte_range else 0
+        outcome = self.outcomes.pop(0)
+        if outcome == "fail":
+            # the session gave up after its own retries
+            raise NetworkError
+        if isinstance(outcome, int):
+            return FakeResponse(outcome)
+        if offset > len(SEGMENT):
+            return FakeResponse(416)
+        return FakeResponse(206 if offset else 200, SEGMENT[offset:])
+
+
+class DownloadSegmentTest(unittest.TestCase):
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.work_dir = temp_dir.name
+        self.stream = VideoStream()
+        self.stream.stream_id = "1"
+        self.segment_path = os.path.join(self.work_dir, "v_1_5.mp4")
+        self.part_path = f"{self.segment_path}.part"
+
+    def new_downloader(self, session: FakeSession) -> Downloader:
+        instance = Downloader.__new__(Downloader)
+        instance.session = session
+        instance.logger = logging.getLogger("downloader_test")
+        instance.movie_work_dir = self.work_dir
+        instance._work_dir_prefix = self.work_dir + os.sep
+        instance._existing_files = set(os.listdir(self.work_dir))
+        instance.manifest = types.SimpleNamespace(base_stream_url="https://cdn/movie", total_number_of_data_segments=9)
+        return instance
+
+    def write(self, path: str, content: bytes) -> None:
+        with open(path, "wb") as f:
+            f.write(content)
+
+    def read(self, path: str) -> bytes:
+        with open(path, "rb") as f:
+            return f.read()
+
+    def download(self, session: FakeSession, segment_number=5, overwrite=False):
+        return self.new_downloader(session)._download_segment(self.stream, segment_number=segment_number, overwrite=overwrite)
+
+    def test_full_download(self):
+        session = FakeSession("ok")
+        self.assertEqual(self.download(session), self.segment_path)
+        self.assertEqual(self.read(self.segment_path), SEGMENT)
+        self.assertEqual(os.listdir(self.work_dir), ["v_1_5.mp4"])
+
+    def test_existing_segment_is_reused(self):
+        self.write(self.segment_path, b"done")
+        session = FakeSession()
+        self.assertEqual(self.download(session), self.segment_path)
+        self.assertEqual(session.ranges, [])
+
+    def test_overwrite_replaces_existing_segment(self):
+        self.write(self.segment_path, b"stale")
+        self.write(self.part_path, b"stale part")
+        session = FakeSession("ok")
+        self.download(session, overwrite=True)
+        self.assertEqual(session.ranges, [None])
+        self.assertEqual(self.read(self.segment_path), SEGMENT)
+
+    def test_resumes_part_file_with_206(self):
+        self.write(self.part_path, SEGMENT[:4])
+        session = FakeSession("ok")
+        self.download(session)
+        self.assertEqual(session.ranges, ["bytes=4-"])
+        self.assertEqual(self.read(self.segment_path), SEGMENT)
+        self.assertFalse(os.path.exists(self.part_path))
+
+    def test_unusable_part_file_restarts_after_416(self):
+        self.write(self.part_path, SEGMENT + b"junk")
+        session = FakeSession("ok", "ok")
+        self.download(session)
+        self.assertEqual(session.ranges, ["bytes=20-", None])
+        self.assertEqual(self.read(self.segment_path), SEGMENT)
+
+    def test_failed_transfer_keeps_part_file(self):
+        self.write(self.part_path, SEGMENT[:4])
+        with self.assertRaises(NetworkError):
+            self.download(FakeSession("fail"))
+        self.assertEqual(self.read(self.part_path), SEGMENT[:4])
+        self.assertFalse(os.path.exists(self.segment_path))
+
+    def test_failed_transfer_leaves_no_empty_part_file(self):
+        with self.assertRaises(NetworkError):
+            self.download(FakeSession("fail"))
+        self.assertEqual(os.listdir(self.work_dir), [])
+
+    def test_part_file_held_by_another_downloader(self):
+        self.write(self.part_path, SEGMENT[:4])
+        downloader._claimed_part_files.add(self.part_path)
+        self.addCleanup(downloader._claimed_part_files.discard, self.part_path)
+        session = FakeSession("ok")
+        self.download(session)
+        self.assertEqual(session.ranges, [None])
+        self.assertEqual(self.read(self.segment_path), SEGMENT)
+        self.assertEqual(self.read(self.part_path), SEGMENT[:4])
+
+    def test_missing_last_segment_is_skipped(self):
+        self.assertIsNone(self.download(FakeSession(404), segment_number=9))
+        self.assertEqual(os.listdir(self.work_dir), [])
+
+    def test_forbidden(self):
+        with self.assertRaises(Forbidden):
+            self.download(FakeSession(403))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,77 @@
+import unittest
+
+from aebn_dl.manifest_parser import Manifest
+
+MANIFEST = b"""<?xml version="1.0"?>
+<MPD xmlns="urn:mpeg:dash:schema:mpd:2011">
+  <Period>
+    <AdaptationSet mimeType="audio/mp4">
+      <SegmentTemplate duration="96000" timescale="48000"/>
+      <Representation id="a1"/>
+    </AdaptationSet>
+    <AdaptationSet mimeType="video/mp4">
+      <SegmentTemplate duration="120000" timescale="30000"/>
+      <Representation id="v720" height="720"/>
+      <Representation id="v360" height="360"/>
+      <Representation id="v1080" height="1080"/>
+    </AdaptationSet>
+  </Period>
+</MPD>"""
+
+VIDEO_STREAMS = [("v360", 360), ("v720", 720), ("v1080", 1080)]
+
+
+def new_manifest(target_height=None, force_resolution=False) -> Manifest:
+    return Manifest(
+        url="https://straight.aebn.com/straight/movies/309021/hot-and-mean-37",
+        total_duration_seconds=None,
+        session=None,
+        target_height=target_height,
+        force_resolution=force_resolution,
+    )
+
+
+class SelectVideoStreamTest(unittest.TestCase):
+    def test_highest_by_default(self):
+        self.assertEqual(new_manifest()._select_video_stream(VIDEO_STREAMS), ("v1080", 1080))
+
+    def test_lowest(self):
+        self.assertEqual(new_manifest(target_height=0)._select_video_stream(VIDEO_STREAMS), ("v360", 360))
+
+    def test_exact_height(self):
+        self.assertEqual(new_manifest(target_height=720)._select_video_stream(VIDEO_STREAMS), ("v720", 720))
+
+    def test_nearest_lower_height(self):
+        self.assertEqual(new_manifest(target_height=900)._select_video_stream(VIDEO_STREAMS), ("v720", 720))
+
+    def test_below_all_heights(self):
+        self.assertEqual(new_manifest(target_height=240)._select_video_stream(VIDEO_STREAMS), ("v360", 360))
+
+    def test_forced_exact_height(self):
+        manifest = new_manifest(target_height=720, force_resolution=True)
+        self.assertEqual(manifest._select_video_stream(VIDEO_STREAMS), ("v720", 720))
+
+    def test_forced_missing_height(self):
+        for target_height in (900, 240):
+            with self.assertRaises(RuntimeError):
+                new_manifest(target_height=target_height, force_resolution=True)._select_video_stream(VIDEO_STREAMS)
+
+
+class ParseManifestTest(unittest.TestCase):
+    def test_video_streams_sorted_by_height(self):
+        manifest = new_manifest()
+        self.assertEqual(manifest._parse_and_sort_video_streams(MANIFEST), VIDEO_STREAMS)
+
+    def test_video_segment_duration(self):
+        manifest = new_manifest()
+        manifest._parse_and_sort_video_streams(MANIFEST)
+        self.assertEqual(manifest.segment_duration, 4.0)
+
+    def test_total_number_of_data_segments(self):
+        manifest = new_manifest()
+        manifest.segment_duration = 4.0
+        self.assertEqual(manifest._total_number_of_data_segments_calc(401), 101)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,51 @@
+import unittest
+
+from aebn_dl import utils
+
+
+def mp4_box(box_type: bytes, payload: bytes = b"") -> bytes:
+    return (8 + len(payload)).to_bytes(4, "big") + box_type + payload
+
+
+class DurationToSecondsTest(unittest.TestCase):
+    def test_hours_minutes_seconds(self):
+        self.assertEqual(utils.duration_to_seconds("01:02:03"), 3723)
+
+    def test_minutes_seconds(self):
+        self.assertEqual(utils.duration_to_seconds("12:34"), 754)
+
+    def test_seconds(self):
+        self.assertEqual(utils.duration_to_seconds("42"), 42)
+
+
+class RemoveCharsTest(unittest.TestCase):
+    def test_strips_forbidden_characters(self):
+        self.assertEqual(utils.remove_chars('a:b?c/d\\e|f*g"h<i>j#k!'), "abcdefghijk")
+
+
+class Mp4BoxesCompleteTest(unittest.TestCase):
+    def test_complete_boxes(self):
+        self.assertTrue(utils._mp4_boxes_complete(mp4_box(b"ftyp", b"isom") + mp4_box(b"moov", b"\0" * 16)))
+
+    def test_empty_data(self):
+        self.assertFalse(utils._mp4_boxes_complete(b""))
+
+    def test_truncated_box(self):
+        self.assertFalse(utils._mp4_boxes_complete(mp4_box(b"mdat", b"\0" * 16)[:-1]))
+
+    def test_truncated_header(self):
+        self.assertFalse(utils._mp4_boxes_complete(mp4_box(b"ftyp") + b"\0\0\0"))
+
+    def test_invalid_box_size(self):
+        self.assertFalse(utils._mp4_boxes_complete((4).to_bytes(4, "big") + b"free"))
+
+    def test_64_bit_box_size(self):
+        box = (1).to_bytes(4, "big") + b"mdat" + (20).to_bytes(8, "big") + b"\0" * 4
+        self.assertTrue(utils._mp4_boxes_complete(box))
+
+    def test_box_to_end_of_data(self):
+        self.assertTrue(utils._mp4_boxes_complete(mp4_box(b"ftyp") + (0).to_bytes(4, "big") + b"mdat" + b"\0" * 10))
+
+
+if __name__ == "__main__":
+    unittest.main()